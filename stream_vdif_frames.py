@@ -1,8 +1,27 @@
+import ctypes
+import errno
+import math
 import numpy as np
+import os
+import queue
+import select
 import socket
 import struct
+import sys
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; the NumPy packer is used instead
+    njit = None
+
+try:
+    import cupy as cp
+    import cupyx
+except ImportError:  # CuPy is optional; synthesis then runs on the CPU
+    cp = None
 
 # Configuration
 DEST_IP = '10.8.81.20'
@@ -15,6 +34,12 @@ SAMPLES_PER_FRAME = 20000
 FRAME_DURATION = SAMPLES_PER_FRAME / SAMPLE_RATE
 FRAMES_PER_SECOND = int(SAMPLE_RATE / SAMPLES_PER_FRAME)
 
+NOISE_RMS = 0.2          # Gaussian noise added to the unit tone
+
+# Precision of the synthesised signal.  2-bit quantisation needs only a few
+# bits, so single precision halves memory traffic at no cost.
+SAMPLE_DTYPE = np.float32
+COMPLEX_DTYPE = np.complex64
 BITS_PER_SAMPLE = 2      # 2-bit quantization
 CHANNELS = 1
 THREAD_ID = 0            # VDIF thread ID
@@ -24,8 +49,112 @@ VDIF_VERSION = 1
 # Compute payload size based on number of samples and quantisation depth
 # (ceil to full bytes).
 PAYLOAD_SIZE = (SAMPLES_PER_FRAME * BITS_PER_SAMPLE + 7) // 8
+HEADER_SIZE = 32
+FRAME_SIZE = HEADER_SIZE + PAYLOAD_SIZE
+
+# Synthesise, quantise and pack on the GPU with CuPy (if installed).  Only
+# worthwhile at sample rates the CPU cannot keep up with.
+USE_GPU = False
+
+# Number of frames handed to the kernel per send call (sendmmsg on Linux).
+BATCH_FRAMES = 32
+
+# The quartile thresholds of the tone-plus-noise signal are stationary, so
+# they are re-estimated (from a single frame) at most this often.
+THRESHOLD_REFRESH_SECONDS = 1.0
+
+# Batches are produced on a separate thread into a ring of this many batch
+# buffers, while the calling thread paces and sends them.
+RING_BATCHES = 4
+
+# Optionally pin the producer and sender threads to CPUs (ideally isolated
+# ones) and run them under SCHED_FIFO at this priority.  Linux only; needs
+# CAP_SYS_NICE for the real-time policy.
+PRODUCER_CPU = None
+SENDER_CPU = None
+REALTIME_PRIORITY = None
+
+# Tones that repeat exactly within this many samples are read from a
+# precomputed table; others are generated by phasor rotation.
+TONE_TABLE_MAX = 1 << 20
+
+# Pacing sleeps until this close to each send deadline, then busy-waits for
+# the remainder to avoid scheduler wake-up jitter.
+SPIN_SECONDS = 50e-6
+
+# Send with MSG_ZEROCOPY (Linux >= 5.0) so the kernel transmits straight
+# from the batch buffer.  Pinning pages costs more than copying ~5 KB
+# datagrams, so this only pays off for larger frames or much higher rates.
+ZEROCOPY = False
+
+# Longest wait for the kernel to release a zero-copy batch before giving up.
+ZEROCOPY_TIMEOUT = 1.0
+
+# Use UDP generic segmentation offload (Linux >= 4.18) where available: a
+# run of frames goes down the stack as one buffer and is split into
+# datagrams by the kernel or NIC.
+GSO = True
+
+# Requested socket send buffer (the kernel caps it at net.core.wmem_max).
+SEND_BUFFER_SIZE = 4 << 20
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+if sys.platform == 'linux':
+    # Set DF and never fragment locally: a VDIF frame must fit in the path
+    # MTU (jumbo frames), otherwise send fails with EMSGSIZE.
+    sock.setsockopt(socket.IPPROTO_IP,
+                    getattr(socket, 'IP_MTU_DISCOVER', 10),
+                    getattr(socket, 'IP_PMTUDISC_DO', 2))
+
+# Noise source (PCG64); draws are written into preallocated buffers
+rng = np.random.default_rng()
+
+# sendmmsg(2) is called through ctypes as Python's socket module does not
+# expose it.  Other platforms fall back to one sendto() per frame.
+_sendmmsg = None
+if sys.platform == 'linux':
+    try:
+        _sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError):
+        pass
+
+# Linux constants for MSG_ZEROCOPY not exported by the socket module
+_SO_ZEROCOPY = 60
+_MSG_ZEROCOPY = 0x4000000
+_IP_RECVERR = 11
+_SO_EE_ORIGIN_ZEROCOPY = 5
+
+# Linux UDP GSO constants; a GSO send is limited to 64 segments and to the
+# maximum UDP payload in total
+_UDP_SEGMENT = 103
+_UDP_MAX_SEGMENTS = 64
+_UDP_MAX_PAYLOAD = 65507
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+class _UDPSegmentCMsg(ctypes.Structure):
+    # struct cmsghdr carrying a UDP_SEGMENT size, padded to CMSG_SPACE(2)
+    _fields_ = [('cmsg_len', ctypes.c_size_t),
+                ('cmsg_level', ctypes.c_int),
+                ('cmsg_type', ctypes.c_int),
+                ('gso_size', ctypes.c_uint16),
+                ('_pad', ctypes.c_uint16 * 3)]
 
 # Reference epoch calculation: number of 6 month periods since
 # 1 Jan 2000 00:00 UTC as required by the VDIF specification.
@@ -34,22 +163,23 @@ def reference_epoch_from_seconds(epoch_seconds: int) -> int:
     half = 0 if epoch.month <= 6 else 1
     return (epoch.year - 2000) * 2 + half
 
-def create_vdif_header(epoch_seconds: int, frame_number: int) -> bytearray:
-    """Construct a 32-byte VDIF header according to the specification."""
-    header = bytearray(32)
+def reference_epoch_end(ref_epoch: int) -> int:
+    """Return the Unix time at which the 6 month period ``ref_epoch`` ends."""
+    year, half = divmod(ref_epoch + 1, 2)
+    end = datetime(2000 + year, 1 + 6 * half, 1, tzinfo=timezone.utc)
+    return int(end.timestamp())
 
-    # Word 0: invalid=0, legacy=0, seconds from reference epoch
-    word0 = epoch_seconds & 0x3FFFFFFF
-    struct.pack_into('<I', header, 0, word0)
-
-    # Word 1: reference epoch and frame number within the second
-    ref_epoch = reference_epoch_from_seconds(epoch_seconds)
-    word1 = ((ref_epoch & 0x3F) << 24) | (frame_number & 0x00FFFFFF)
-    struct.pack_into('<I', header, 4, word1)
+def vdif_header_template() -> bytearray:
+    """Construct a 32-byte VDIF header with the words that are constant for
+    the whole run filled in.  Words 0 and 1 (time and frame number) are left
+    zero; the producer patches them per frame with write_vdif_time(), using
+    a cached reference epoch."""
+    header = bytearray(HEADER_SIZE)
 
     # Word 2: VDIF version, log2 channels, frame length (in units of 8 bytes)
     frame_length_units = (len(header) + PAYLOAD_SIZE) // 8
-    word2 = ((VDIF_VERSION & 0x7) << 29) | ((int(np.log2(CHANNELS)) & 0x1F) << 24) | (frame_length_units & 0x00FFFFFF)
+    log2_channels = CHANNELS.bit_length() - 1
+    word2 = ((VDIF_VERSION & 0x7) << 29) | ((log2_channels & 0x1F) << 24) | (frame_length_units & 0x00FFFFFF)
     struct.pack_into('<I', header, 8, word2)
 
     # Word 3: data type=0 (real), bits/sample-1, thread id, station id
@@ -60,61 +190,557 @@ def create_vdif_header(epoch_seconds: int, frame_number: int) -> bytearray:
     # Remaining header words (4-7) set to zero for simplicity
     return header
 
-def quantize_signal(signal):
-    """Quantize the floating point signal into 2-bit samples."""
-    thresholds = np.percentile(signal, [25, 50, 75])
-    quantized = np.digitize(signal, thresholds, right=True)
-    return quantized.astype(np.uint8)
-
-def generate_payload(samples):
-    # Pack 2-bit samples into bytes (4 samples per byte)
-    packed = bytearray()
-    for i in range(0, len(samples), 4):
-        byte = 0
-        for bit_pos in range(4):
-            if i + bit_pos < len(samples):
-                val = samples[i + bit_pos] & 0x03
-            else:
-                val = 0
-            byte |= val << (6 - 2 * bit_pos)
-        packed.append(byte)
-    return packed
+HEADER_TEMPLATE = vdif_header_template()
+
+# Header words 0 and 1, the only ones that change per frame
+_TIME_WORDS = struct.Struct('<II')
+
+def write_vdif_time(buf, offset: int, epoch_seconds: int, frame_number: int,
+                    ref_epoch: int) -> None:
+    """Write header words 0 and 1 into ``buf`` at ``offset`` in one call."""
+    # Word 0: invalid=0, legacy=0, seconds from reference epoch
+    word0 = epoch_seconds & 0x3FFFFFFF
+
+    # Word 1: reference epoch and frame number within the second
+    word1 = ((ref_epoch & 0x3F) << 24) | (frame_number & 0x00FFFFFF)
+    _TIME_WORDS.pack_into(buf, offset, word0, word1)
+
+def create_vdif_header(epoch_seconds: int, frame_number: int) -> bytearray:
+    """Construct a 32-byte VDIF header according to the specification."""
+    header = bytearray(HEADER_TEMPLATE)
+    write_vdif_time(header, 0, epoch_seconds, frame_number,
+                    reference_epoch_from_seconds(epoch_seconds))
+    return header
+
+def quantize_thresholds(signal):
+    """Return the 2-bit quantisation thresholds (quartiles) of the signal.
+
+    For a 2-D (frames x samples) signal the result has one row of three
+    thresholds per frame.
+    """
+    return np.percentile(signal, [25, 50, 75], axis=-1).T
+
+def quantize_signal(signal, thresholds=None, out=None, mask=None):
+    """Quantize the floating point signal into 2-bit samples.
+
+    A sample's level is the number of thresholds it exceeds, computed as a
+    branchless sum of comparisons.  ``thresholds`` may hold one row per
+    frame of a 2-D signal.  The levels are written into ``out`` (uint8) and
+    ``mask`` (bool) is used as scratch; both are allocated if not given.
+    """
+    if thresholds is None:
+        thresholds = quantize_thresholds(signal)
+    t = np.asarray(thresholds)
+    if out is None:
+        out = np.empty(np.shape(signal), dtype=np.uint8)
+    if mask is None:
+        mask = np.empty(np.shape(signal), dtype=np.bool_)
+    np.greater(signal, t[..., 0, None], out=out.view(np.bool_))
+    for k in (1, 2):
+        np.greater(signal, t[..., k, None], out=mask)
+        out += mask
+    return out
+
+def generate_payload(samples, out=None):
+    # Pack 2-bit samples into bytes (4 samples per byte, first sample in the
+    # most significant bits).  Each row of a 2-D array is packed separately
+    # and padded to a whole number of bytes.  The bytes are written into
+    # ``out`` (a uint8 array with one row per row of samples) if given, and
+    # returned as a bytes object otherwise.
+    #
+    # Eight samples are loaded as one big-endian uint64 and their 2-bit
+    # fields gathered into the low 16 bits with SWAR shift/mask steps.
+    s = np.asarray(samples, dtype=np.uint8)
+    n = s.shape[-1]
+    pad = -n % 8
+    if pad:
+        s = np.pad(s, [(0, 0)] * (s.ndim - 1) + [(0, pad)])
+    x = np.ascontiguousarray(s).view('>u8').astype(np.uint64)
+    x &= 0x0303030303030303
+    x |= x >> 6
+    x &= 0x000F000F000F000F
+    x |= x >> 12
+    x &= 0x000000FF000000FF
+    x |= x >> 24
+
+    if out is not None and not pad:
+        # Whole 16-bit groups: store them straight into the output
+        np.copyto(out.view('>u2'), x, casting='unsafe')
+        return out
+    packed = x.astype('>u2').view(np.uint8)
+    packed = packed.reshape(s.shape[:-1] + (-1,))[..., :(n + 3) // 4]
+    if out is None:
+        return packed.tobytes()
+    out[...] = packed
+    return out
+
+def pack_2bit(samples, out):
+    """Pack 2-bit samples into the preallocated uint8 array ``out`` (one row
+    per row of ``samples`` if 2-D)."""
+    generate_payload(samples[..., :4 * out.shape[-1]], out=out)
+
+if njit is not None:
+    @njit(cache=True, boundscheck=False, nogil=True)
+    def synthesize_and_pack(tone, noise_rms, thresholds, gen, out, probe):
+        """Synthesise, quantize and pack a batch of frames in one pass.
+
+        Sample k of frame f is ``tone[f, k]`` plus Gaussian noise of RMS
+        ``noise_rms`` drawn from Generator ``gen``.  It is quantized against
+        ``thresholds`` and packed into ``out[f]`` without ever storing the
+        float signal, except for frame 0, which is copied to ``probe`` for
+        later threshold estimation.  All arithmetic is done in float32.
+        """
+        rms = np.float32(noise_rms)
+        t0 = np.float32(thresholds[0])
+        t1 = np.float32(thresholds[1])
+        t2 = np.float32(thresholds[2])
+        for f in range(out.shape[0]):
+            for i in range(out.shape[1]):
+                byte = 0
+                for k in range(4):
+                    v = tone[f, 4 * i + k] + rms * np.float32(gen.standard_normal())
+                    if f == 0:
+                        probe[4 * i + k] = v
+                    byte |= ((v > t0) + (v > t1) + (v > t2)) << (6 - 2 * k)
+                out[f, i] = byte
+
+def _reap_zerocopy(sock, poller, timeout):
+    """Wait up to ``timeout`` seconds for MSG_ZEROCOPY completion
+    notifications on the socket error queue and return the number of sends
+    they cover.  Raises TimeoutError if nothing arrives in time and OSError
+    for any other error found on the queue."""
+    if not poller.poll(int(timeout * 1000)):
+        raise TimeoutError(f"No MSG_ZEROCOPY completion within {timeout} s")
+    completed = 0
+    _, ancdata, _, _ = sock.recvmsg(0, 256, socket.MSG_ERRQUEUE)
+    for level, kind, data in ancdata:
+        if level != socket.IPPROTO_IP or kind != _IP_RECVERR:
+            continue
+        # struct sock_extended_err; ee_info..ee_data is the completed range
+        err, origin, _, _, _, first, last = struct.unpack_from('=IBBBBII', data)
+        if origin != _SO_EE_ORIGIN_ZEROCOPY:
+            raise OSError(err, os.strerror(err))
+        completed += (last - first + 1) & 0xFFFFFFFF
+    return completed
+
+def make_batch_sender(sock, batch, frame_size, zerocopy=False, gso=False):
+    """Return ``send(n)`` which transmits the first n frames of ``batch``.
+
+    ``batch`` is a bytearray holding consecutive frames of ``frame_size``
+    bytes and ``sock`` must already be connected to the destination.  On
+    Linux the message headers are built once and each call is a single
+    sendmmsg() syscall.  With ``gso`` (if the kernel supports UDP_SEGMENT)
+    each message carries a run of frames that the kernel splits into
+    ``frame_size`` datagrams; if the route rejects a GSO send (EIO or
+    EINVAL) the sender drops to one frame per message for good.  ICMP port
+    unreachable errors reported on the connected socket (ECONNREFUSED,
+    e.g. while the receiver is not yet listening) are ignored.  With
+    ``zerocopy`` the frames are sent with MSG_ZEROCOPY and ``send`` only
+    returns once the kernel has released the buffer, so the caller may
+    overwrite it straight away.
+    """
+    view = memoryview(batch)
+    max_frames = len(batch) // frame_size
+
+    if _sendmmsg is None:
+        def send(n):
+            for i in range(n):
+                frame = view[i * frame_size:(i + 1) * frame_size]
+                try:
+                    sock.send(frame)
+                except ConnectionRefusedError:
+                    sock.send(frame)  # The pending error is now cleared
+        return send
+
+    buf = (ctypes.c_char * len(batch)).from_buffer(batch)
+    fd = sock.fileno()
+    msg_size = ctypes.sizeof(_MMsgHdr)
+
+    # Segment size is passed per message (UDP_SEGMENT control message) so
+    # each sender can drop GSO on its own
+    segment = _UDPSegmentCMsg(
+        cmsg_len=_UDPSegmentCMsg.gso_size.offset + 2,
+        cmsg_level=socket.SOL_UDP, cmsg_type=_UDP_SEGMENT, gso_size=frame_size)
+
+    def build_messages(frames_per_msg):
+        # One message per run of ``frames_per_msg`` frames
+        msg_bytes = frames_per_msg * frame_size
+        max_msgs = -(-max_frames // frames_per_msg)
+        iov_lens = [min(msg_bytes, max_frames * frame_size - j * msg_bytes)
+                    for j in range(max_msgs)]
+        iov = (_IOVec * max_msgs)()
+        msgs = (_MMsgHdr * max_msgs)()
+        for j in range(max_msgs):
+            iov[j].iov_base = ctypes.addressof(buf) + j * msg_bytes
+            iov[j].iov_len = iov_lens[j]
+            hdr = msgs[j].msg_hdr
+            hdr.msg_iov = ctypes.pointer(iov[j])
+            hdr.msg_iovlen = 1
+            if frames_per_msg > 1:
+                hdr.msg_control = ctypes.addressof(segment)
+                hdr.msg_controllen = ctypes.sizeof(segment)
+        # The message headers hold raw addresses; keep their targets alive
+        send.keepalive = (buf, iov, segment)
+        return iov, msgs, iov_lens
+
+    frames_per_msg = 1
+    if gso:
+        # Probe for kernel support; the socket-wide segment size stays unset
+        try:
+            sock.setsockopt(socket.SOL_UDP, _UDP_SEGMENT, frame_size)
+            sock.setsockopt(socket.SOL_UDP, _UDP_SEGMENT, 0)
+        except OSError:
+            pass  # Kernel without UDP GSO; send one frame per message
+        else:
+            frames_per_msg = max(1, min(_UDP_MAX_SEGMENTS,
+                                        _UDP_MAX_PAYLOAD // frame_size))
+
+    flags = 0
+    if zerocopy:
+        sock.setsockopt(socket.SOL_SOCKET, _SO_ZEROCOPY, 1)
+        flags = _MSG_ZEROCOPY
+        # Error queue readiness is always reported as POLLERR
+        poller = select.poll()
+        poller.register(fd, 0)
+
+    def send(n):
+        nonlocal frames_per_msg, iov, msgs, iov_lens
+        done = 0        # frames already sent
+        n_sent = 0      # messages already sent
+        while True:
+            # A trailing partial run of frames is sent by shortening its iovec
+            full, partial = divmod(n, frames_per_msg)
+            n_msgs = full + (partial > 0)
+            if partial:
+                iov[full].iov_len = partial * frame_size
+            sent = done // frames_per_msg
+            err = 0
+            try:
+                while sent < n_msgs:
+                    ret = _sendmmsg(fd, ctypes.byref(msgs, sent * msg_size),
+                                    n_msgs - sent, flags)
+                    if ret < 0:
+                        err = ctypes.get_errno()
+                        if err == errno.ECONNREFUSED:
+                            # Reported for an earlier datagram and cleared by
+                            # this call; nothing was sent, so retry
+                            err = 0
+                            continue
+                        break
+                    sent += ret
+                    n_sent += ret
+            finally:
+                if partial:
+                    iov[full].iov_len = iov_lens[full]
+            if not err:
+                break
+            if frames_per_msg == 1 or err not in (errno.EIO, errno.EINVAL):
+                raise OSError(err, os.strerror(err))
+
+            # The route rejects GSO (no checksum offload, or segments larger
+            # than its MTU): resend the rest one frame per message
+            done = sent * frames_per_msg
+            frames_per_msg = 1
+            iov, msgs, iov_lens = build_messages(frames_per_msg)
+
+        if zerocopy:
+            pending = n_sent
+            while pending > 0:
+                pending -= _reap_zerocopy(sock, poller, ZEROCOPY_TIMEOUT)
+
+    iov, msgs, iov_lens = build_messages(frames_per_msg)
+    return send
+
+def wait_until(deadline):
+    """Block until time.monotonic() reaches ``deadline``."""
+    remaining = deadline - time.monotonic() - SPIN_SECONDS
+    if remaining > 0:
+        time.sleep(remaining)
+    while time.monotonic() < deadline:
+        pass
+
+def pin_current_thread(cpu, priority=None):
+    """Pin the calling thread to ``cpu`` and, if ``priority`` is given, switch
+    it to SCHED_FIFO.  Settings that cannot be applied are reported and
+    otherwise ignored."""
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError as exc:
+            print(f"Could not pin thread to CPU {cpu}: {exc}")
+    if priority is not None and hasattr(os, 'sched_setscheduler'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except OSError as exc:
+            print(f"Could not set SCHED_FIFO priority {priority}: {exc}")
+
+def tone_period(frequency):
+    """Return the number of samples after which a tone at ``frequency``
+    repeats exactly, or None if the rates are not whole numbers of Hz."""
+    if not (float(frequency).is_integer() and float(SAMPLE_RATE).is_integer()):
+        return None
+    rate = int(SAMPLE_RATE)
+    return rate // math.gcd(rate, int(frequency))
+
+def make_tone_generator(frequency, n):
+    """Return ``next_block()`` which yields successive n-sample blocks of a
+    continuous unit sine at ``frequency``.  Blocks must be treated as
+    read-only and are only valid until the next call.
+
+    If the tone repeats every q <= TONE_TABLE_MAX samples, q + n samples of
+    it are tabulated once and each block is simply a view into that table
+    at the running offset.  Otherwise the per-sample rotations
+    exp(i*omega*k) are computed once and each block is a single complex
+    multiply by the running phasor, which is advanced by exp(i*omega*n) and
+    renormalised so that rounding does not build up.
+    """
+    omega = 2 * np.pi * frequency / SAMPLE_RATE
+    period = tone_period(frequency)
+
+    if period is not None and period <= TONE_TABLE_MAX:
+        table = np.sin(omega * (np.arange(period + n) % period)).astype(SAMPLE_DTYPE)
+        table.flags.writeable = False
+        offset = 0
+
+        def next_block():
+            nonlocal offset
+            block = table[offset:offset + n]
+            offset = (offset + n) % period
+            return block
+        return next_block
+
+    rotations = np.exp(1j * omega * np.arange(n)).astype(COMPLEX_DTYPE)
+    step = np.exp(1j * omega * n)
+    block = np.empty(n, dtype=COMPLEX_DTYPE)
+    phasor = 1 + 0j
+
+    def next_block():
+        nonlocal phasor
+        np.multiply(rotations, phasor, out=block)
+        phasor *= step
+        phasor /= abs(phasor)
+        return block.imag
+    return next_block
+
+def make_batch_producer(frequency):
+    """Return ``produce(out, refresh)`` which synthesises the next batch of
+    tone-plus-noise frames and quantises and packs them into the rows of
+    ``out`` (frames x payload bytes).  The quantisation thresholds are
+    re-estimated from the first frame when ``refresh`` is true."""
+    if njit is not None and SAMPLES_PER_FRAME % 4 == 0:
+        return make_fused_batch_producer(frequency)
+
+    # Continuous tone so that the phase does not reset each frame; one block
+    # covers a whole batch
+    next_tone = make_tone_generator(frequency, BATCH_FRAMES * SAMPLES_PER_FRAME)
+
+    # Signal buffer for a batch of frames (frames x samples), plus work
+    # buffers for the levels, all reused rather than allocated each batch
+    signal = np.empty((BATCH_FRAMES, SAMPLES_PER_FRAME), dtype=SAMPLE_DTYPE)
+    levels = np.empty(signal.shape, dtype=np.uint8)
+    mask = np.empty(signal.shape, dtype=np.bool_)
+    thresholds = None
+
+    def produce(out, refresh):
+        nonlocal thresholds
+        # Sine wave with noise for the whole batch, in place (a partial
+        # final batch uses only the leading rows)
+        rng.standard_normal(out=signal, dtype=SAMPLE_DTYPE)
+        np.multiply(signal, NOISE_RMS, out=signal)
+        np.add(signal, next_tone().reshape(signal.shape), out=signal)
+
+        if refresh:
+            thresholds = quantize_thresholds(signal[0])
+        n = len(out)
+        quantize_signal(signal[:n], thresholds, out=levels[:n], mask=mask[:n])
+        pack_2bit(levels[:n], out)
+    return produce
+
+def make_fused_batch_producer(frequency):
+    """Numba counterpart of make_batch_producer() built on
+    synthesize_and_pack(), so no per-batch signal array is materialised.
+
+    Thresholds are estimated from frame 0 of the previous batch (kept in a
+    probe buffer), or from a frame synthesised up front for the first one.
+    Requires SAMPLES_PER_FRAME to be a multiple of 4.
+    """
+    # The kernel is compiled without bounds checks and packs whole bytes
+    if SAMPLES_PER_FRAME % 4:
+        raise ValueError(f"SAMPLES_PER_FRAME ({SAMPLES_PER_FRAME}) must be a multiple of 4")
+    next_tone = make_tone_generator(frequency, BATCH_FRAMES * SAMPLES_PER_FRAME)
+    probe = (make_tone_generator(frequency, SAMPLES_PER_FRAME)() +
+             NOISE_RMS * rng.standard_normal(SAMPLES_PER_FRAME, dtype=SAMPLE_DTYPE))
+    thresholds = None
+
+    def produce(out, refresh):
+        nonlocal thresholds
+        if refresh:
+            thresholds = quantize_thresholds(probe)
+        tone = next_tone().reshape(BATCH_FRAMES, SAMPLES_PER_FRAME)
+        synthesize_and_pack(tone, NOISE_RMS, thresholds, rng, out, probe)
+    return produce
+
+if cp is not None:
+    # One thread per output byte: quantise four samples against the
+    # thresholds and pack them, first sample in the most significant bits
+    _gpu_quantize_and_pack = cp.ElementwiseKernel(
+        'raw T signal, T t0, T t1, T t2', 'uint8 out',
+        '''
+        unsigned char byte = 0;
+        for (int k = 0; k < 4; k++) {
+            T v = signal[4 * i + k];
+            byte |= ((v > t0) + (v > t1) + (v > t2)) << (6 - 2 * k);
+        }
+        out = byte;
+        ''',
+        'vdif_quantize_and_pack')
+
+def make_gpu_batch_producer(frequency):
+    """GPU (CuPy) counterpart of make_batch_producer().
+
+    The tone, noise, quantisation and packing all run on the device; only
+    the packed payloads are copied back, through a pinned host buffer.
+    Requires SAMPLES_PER_FRAME to be a multiple of 4.
+    """
+    if SAMPLES_PER_FRAME % 4:
+        raise ValueError(f"SAMPLES_PER_FRAME ({SAMPLES_PER_FRAME}) must be a multiple of 4")
+    n = BATCH_FRAMES * SAMPLES_PER_FRAME
+    omega = 2 * np.pi * frequency / SAMPLE_RATE
+    rotations = cp.exp(1j * omega * cp.arange(n)).astype(COMPLEX_DTYPE)
+    step = np.exp(1j * omega * n)
+    tone = cp.empty(n, dtype=COMPLEX_DTYPE)
+    packed = cp.empty((BATCH_FRAMES, PAYLOAD_SIZE), dtype=cp.uint8)
+    host = cupyx.empty_pinned((BATCH_FRAMES, PAYLOAD_SIZE), dtype=np.uint8)
+    stream = cp.cuda.Stream(non_blocking=True)
+    phasor = 1 + 0j
+    thresholds = None
+
+    def produce(out, refresh):
+        nonlocal phasor, thresholds
+        with stream:
+            cp.multiply(rotations, phasor, out=tone)
+            phasor *= step
+            phasor /= abs(phasor)
+            signal = cp.random.standard_normal((BATCH_FRAMES, SAMPLES_PER_FRAME),
+                                               dtype=SAMPLE_DTYPE)
+            signal *= NOISE_RMS
+            signal += tone.imag.reshape(signal.shape)
+
+            if refresh:
+                thresholds = cp.percentile(signal[0], [25, 50, 75]).get().tolist()
+            _gpu_quantize_and_pack(signal, *thresholds, packed)
+            packed.get(stream=stream, out=host)
+        stream.synchronize()
+        out[:] = host[:len(out)]
+    return produce
 
 def generate_and_send_frames(duration_seconds=2):
-    # Number of samples in each frame is fixed by configuration
-    samples_per_frame = SAMPLES_PER_FRAME
     epoch_start = int(time.time())
     num_frames = int(duration_seconds * FRAMES_PER_SECOND)
 
-    # Use continuous time base so that the tone does not reset each frame
-    t0 = np.arange(samples_per_frame) / SAMPLE_RATE
+    # Connect once so that each send skips destination lookup
+    sock.connect((DEST_IP, DEST_PORT))
+
     frequency = 1e6
+    if USE_GPU and cp is not None:
+        produce = make_gpu_batch_producer(frequency)
+    else:
+        produce = make_batch_producer(frequency)
+
+    # Frames are built in place in contiguous batch buffers, handed from the
+    # producer thread to the sender through ``ready`` and returned through
+    # ``free``; ``payloads`` views the payload region of each frame slot
+    batches = [bytearray(BATCH_FRAMES * FRAME_SIZE) for _ in range(RING_BATCHES)]
+    payloads = [np.frombuffer(batch, dtype=np.uint8).reshape(BATCH_FRAMES, FRAME_SIZE)[:, HEADER_SIZE:]
+                for batch in batches]
+    senders = [make_batch_sender(sock, batch, FRAME_SIZE, zerocopy=ZEROCOPY, gso=GSO)
+               for batch in batches]
+    free = queue.Queue()
+    ready = queue.Queue()
+
+    # Each batch slot starts with the constant header words; only words 0-1
+    # are rewritten per frame
+    for index, batch in enumerate(batches):
+        batch_view = memoryview(batch)
+        for offset in range(0, len(batch), FRAME_SIZE):
+            batch_view[offset:offset + HEADER_SIZE] = HEADER_TEMPLATE
+        free.put(index)
 
-    for frame_num in range(num_frames):
-        epoch_seconds = epoch_start + frame_num // FRAMES_PER_SECOND
-        t = t0 + (frame_num * samples_per_frame) / SAMPLE_RATE
+    refresh_frames = max(1, int(THRESHOLD_REFRESH_SECONDS * FRAMES_PER_SECOND))
+    failure = []
+    stop = threading.Event()
 
-        # Generate sine wave with noise
-        signal = np.sin(2 * np.pi * frequency * t) + np.random.normal(0, 0.2, samples_per_frame)
+    def producer():
+        pin_current_thread(PRODUCER_CPU, REALTIME_PRIORITY)
+        next_refresh = 0
+        # The reference epoch field of word 1 only changes every 6 months
+        ref_epoch_ends = 0
+        try:
+            for first_frame in range(0, num_frames, BATCH_FRAMES):
+                queued = min(BATCH_FRAMES, num_frames - first_frame)
+                index = free.get()
+                if stop.is_set():
+                    break
+                batch = batches[index]
 
-        # Quantize
-        quantized_signal = quantize_signal(signal)
+                # Generate the batch straight into the frames' payload slots
+                refresh = first_frame >= next_refresh
+                if refresh:
+                    next_refresh = first_frame + refresh_frames
+                produce(payloads[index][:queued], refresh)
 
-        # Generate payload
-        payload = generate_payload(quantized_signal)[:PAYLOAD_SIZE]
+                # VDIF Headers: patch words 0-1 of each frame in place
+                for slot in range(queued):
+                    frame_num = first_frame + slot
+                    epoch_seconds = epoch_start + frame_num // FRAMES_PER_SECOND
+                    if epoch_seconds >= ref_epoch_ends:
+                        ref_epoch = reference_epoch_from_seconds(epoch_seconds)
+                        ref_epoch_ends = reference_epoch_end(ref_epoch)
+                    write_vdif_time(batch, slot * FRAME_SIZE, epoch_seconds,
+                                    frame_num % FRAMES_PER_SECOND, ref_epoch)
 
-        # VDIF Header
-        frame_in_second = frame_num % FRAMES_PER_SECOND
-        header = create_vdif_header(epoch_seconds, frame_in_second)
+                ready.put((index, first_frame, queued))
+        except BaseException as exc:
+            failure.append(exc)
+        finally:
+            ready.put(None)
 
-        # Full frame
-        vdif_frame = header + payload
+    def sender():
+        pin_current_thread(SENDER_CPU, REALTIME_PRIORITY)
+        # Send deadlines are absolute so that pacing errors do not accumulate.
+        # They count from the first batch, so producer start-up (e.g. Numba
+        # compilation) is not made up for by sending a burst
+        start = None
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                index, first_frame, queued = item
+                if start is None:
+                    start = time.monotonic()
 
-        # Send UDP frame
-        sock.sendto(vdif_frame, (DEST_IP, DEST_PORT))
+                # Send the batch, then wait until the time it covers has elapsed
+                senders[index](queued)
+                free.put(index)
+                wait_until(start + (first_frame + queued) * FRAME_DURATION)
+        except BaseException as exc:
+            failure.append(exc)
+            # Wake a producer waiting for a free batch so that it stops
+            stop.set()
+            for index in range(RING_BATCHES):
+                free.put(index)
 
-        # Sleep until next frame
-        time.sleep(FRAME_DURATION)
+    # Both loops run on their own threads so that the pinning and real-time
+    # priority they request never stick to the caller's thread
+    threads = [threading.Thread(target=producer, name='vdif-producer', daemon=True),
+               threading.Thread(target=sender, name='vdif-sender', daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failure:
+        raise failure[0]
 
 if __name__ == "__main__":
     print(f"Sending VDIF frames to {DEST_IP}:{DEST_PORT}")